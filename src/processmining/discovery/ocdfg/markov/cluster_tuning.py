@@ -1,31 +1,44 @@
 from processmining.discovery.ocdfg.markov import constants as ocdfgmarkov_const
-import pandas as pd
 
 def similarity_tuning(sim_matrix, dir=ocdfgmarkov_const.lbl_out, threshold=None, clusters=None):
     from processmining.discovery.ocdfg.markov import discover as disc
+    # Sort the edges of the direction once; every threshold then only scans the edges above it
+    edges = disc.get_sorted_edges(sim_matrix, dir)
+
     if clusters==None:
         clusters={}
-        clusters[0] = disc.discover_clusters(sim_matrix, 0, dir)
-        clusters[1] = disc.discover_clusters(sim_matrix, 1, dir)
-        clusters = similarity_tuning(sim_matrix, threshold=0.5, clusters=clusters)
-    elif threshold in clusters.keys():
+        clusters[0] = disc.discover_clusters_from_edges(edges, 0)
+        clusters[1] = disc.discover_clusters_from_edges(edges, 1)
+
+    if threshold==None:
+        threshold = 0.5
+    if threshold in clusters.keys():
         return clusters
-    else:    
-        c = disc.discover_clusters(sim_matrix, threshold, dir)
-        clusters[threshold] = c
 
-        upper = min([k for k,v in clusters.items() if k > threshold])
-        lower = max([k for k,v in clusters.items() if k < threshold])
+    # Bisect the threshold range: (threshold, lower, upper) where lower and upper are its nearest explored neighbours
+    upper = min([k for k,v in clusters.items() if k > threshold])
+    lower = max([k for k,v in clusters.items() if k < threshold])
+    pending = [(threshold, lower, upper)]
+    while pending:
+        (threshold, lower, upper) = pending.pop()
+        if threshold in clusters.keys():
+            continue
 
-        if len(clusters[threshold])!=len(clusters[upper]):
-            clusters = similarity_tuning(sim_matrix, threshold=round((threshold+upper)/2,2), clusters=clusters)
+        clusters[threshold] = disc.discover_clusters_from_edges(edges, threshold)
 
         if len(clusters[threshold])!=len(clusters[lower]):
-            clusters = similarity_tuning(sim_matrix, threshold=round((threshold+lower)/2,2), clusters=clusters)
+            pending.append((round((threshold+lower)/2,2), lower, threshold))
+
+        if len(clusters[threshold])!=len(clusters[upper]):
+            pending.append((round((threshold+upper)/2,2), threshold, upper))
 
     return clusters
 
 def get_optimised_similarity_tuning(sim_matrix, dir=ocdfgmarkov_const.lbl_out):
     tunned_similarity_clusters = similarity_tuning(sim_matrix, dir)
-    return {k[0]:tunned_similarity_clusters[k[0]] for v,k in pd.DataFrame({(k,len(v)) for k,v in tunned_similarity_clusters.items()},index=None).groupby(by=[1]).min(0).reset_index().iterrows()}
-    
\ No newline at end of file
+    # Smallest threshold for each distinct number of clusters
+    best = {}
+    for k,v in tunned_similarity_clusters.items():
+        if not len(v) in best or k < best[len(v)]:
+            best[len(v)] = k
+    return {best[n]:tunned_similarity_clusters[best[n]] for n in sorted(best)}
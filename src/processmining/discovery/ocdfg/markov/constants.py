@@ -1,4 +1,5 @@
 lbl_in = "in"
 lbl_out = "out"
 lbl_inout = "inout"
-lbl_approach = "markov"
\ No newline at end of file
+lbl_approach = "markov"
+directions = [lbl_in, lbl_out, lbl_inout]
\ No newline at end of file
@@ -1,29 +1,28 @@
 from processmining.discovery.ocdfg.markov import constants as ocdfgmarkov_const
 from processmining.discovery.ocdfg import constants as ocdfg_const
+from collections import defaultdict
+import numpy as np
 
 def get_weights(ocdfg):
     oc_weighted_edges = {}
     oc_weighted_edges_outputs = {}
     oc_weighted_edges_input = {}
+    event_couples = ocdfg[ocdfg_const.lbl_edges][ocdfg_const.lbl_event_couples]
 
     for obj in ocdfg[ocdfg_const.lbl_object_types]:
         oc_weighted_edges[obj] = {}
         oc_weighted_edges_outputs[obj] = {}
         oc_weighted_edges_input[obj] = {}
-        if obj in ocdfg[ocdfg_const.lbl_edges][ocdfg_const.lbl_event_couples].keys():
-            for (e1,e2) in ocdfg[ocdfg_const.lbl_edges][ocdfg_const.lbl_event_couples][obj]:
-                ev_list = ocdfg[ocdfg_const.lbl_edges][ocdfg_const.lbl_event_couples][obj][(e1,e2)]
-                oc_weighted_edges[obj][(e1,e2)] = len(ev_list)
-
-                if e1 in oc_weighted_edges_outputs[obj].keys():
-                    oc_weighted_edges_outputs[obj][e1] += len(ev_list)
-                else:
-                    oc_weighted_edges_outputs[obj][e1] = len(ev_list)
-
-                if e2 in oc_weighted_edges_input[obj].keys():
-                    oc_weighted_edges_input[obj][e2] += len(ev_list)
-                else:
-                    oc_weighted_edges_input[obj][e2] = len(ev_list)
+        if obj in event_couples:
+            weights = {pair:len(ev_list) for pair,ev_list in event_couples[obj].items()}
+            outputs = defaultdict(int)
+            inputs = defaultdict(int)
+            for ((e1,e2),w) in weights.items():
+                outputs[e1] += w
+                inputs[e2] += w
+            oc_weighted_edges[obj] = weights
+            oc_weighted_edges_outputs[obj] = dict(outputs)
+            oc_weighted_edges_input[obj] = dict(inputs)
 
     return (oc_weighted_edges_input, oc_weighted_edges_outputs, oc_weighted_edges)
 
@@ -32,57 +31,76 @@ def discover_ocdfg_markov(ocdfg):
     oc_weighted_edges_markov = {}
 
     for obj in oc_weighted_edges.keys():
-        oc_weighted_edges_markov[obj] = {}
-        for (e1,e2) in oc_weighted_edges[obj]:
-            oc_weighted_edges_markov[obj][(e1,e2, ocdfgmarkov_const.lbl_in)] = oc_weighted_edges[obj][(e1,e2)]     /    oc_weighted_edges_input[obj][(e2)]
-            oc_weighted_edges_markov[obj][(e1,e2, ocdfgmarkov_const.lbl_out)] = oc_weighted_edges[obj][(e1,e2)]    /    oc_weighted_edges_outputs[obj][(e1)]
-            oc_weighted_edges_markov[obj][(e1,e2, ocdfgmarkov_const.lbl_inout)] = oc_weighted_edges[obj][(e1,e2)] / (oc_weighted_edges_input[obj][(e2)] + oc_weighted_edges_outputs[obj][(e1)] )
+        markov = oc_weighted_edges_markov[obj] = {}
+        inputs = oc_weighted_edges_input[obj]
+        outputs = oc_weighted_edges_outputs[obj]
+        for ((e1,e2),w) in oc_weighted_edges[obj].items():
+            i = inputs[e2]
+            o = outputs[e1]
+            markov[(e1,e2, ocdfgmarkov_const.lbl_in)] = w / i
+            markov[(e1,e2, ocdfgmarkov_const.lbl_out)] = w / o
+            markov[(e1,e2, ocdfgmarkov_const.lbl_inout)] = w / (i + o)
             
     ocdfg[ocdfgmarkov_const.lbl_approach] = oc_weighted_edges_markov
     return ocdfg
     
 
 def get_probability(ocdfgmkv, obj, a1, a2, dir):
-    if not (a1,a2,dir) in ocdfgmkv[ocdfgmarkov_const.lbl_approach][obj].keys():
-        return 0
-    else:
-        return ocdfgmkv[ocdfgmarkov_const.lbl_approach][obj][(a1,a2, dir)]
+    return ocdfgmkv[ocdfgmarkov_const.lbl_approach][obj].get((a1,a2, dir), 0)
         
+def get_probability_tensor(ocdfgmkv):
+    # Dense copy of the markov probabilities, indexed as [direction, object type, activity, activity]
+    approach = ocdfgmkv[ocdfgmarkov_const.lbl_approach]
+    object_types = list(approach.keys())
+    activities = list(ocdfgmkv[ocdfg_const.lbl_activities])
+    dir_idx = {d:i for i,d in enumerate(ocdfgmarkov_const.directions)}
+    act_idx = {a:i for i,a in enumerate(activities)}
+
+    P = np.zeros((len(dir_idx), len(object_types), len(activities), len(activities)), dtype=np.float64)
+    for i, obj in enumerate(object_types):
+        for ((a1,a2,d),v) in approach[obj].items():
+            if a1 in act_idx and a2 in act_idx:
+                P[dir_idx[d], i, act_idx[a1], act_idx[a2]] = v
+
+    return (P, object_types, activities)
+
+def discover_similarity_array(ocdfgmkv, precision_round=2):
+    # Similarity as a [direction, object type, object type] array, in the order of constants.directions and the returned object types
+    (prob_tensor, object_types, activities) = get_probability_tensor(ocdfgmkv)
+    K = len(object_types)
+
+    # One row per object type over all activity pairs, so that the pairwise products of all directions come from a single batched matmul
+    P = prob_tensor.reshape(len(ocdfgmarkov_const.directions), K, len(activities)*len(activities))
+    # Activity pairs that are not an edge of any object type add nothing to the products, so only the observed edges are kept
+    P = P[:,:,P.any(axis=(0, 1))]
+    dots = P @ P.transpose(0, 2, 1)
+    norms = (P*P).sum(axis=2)
+
+    # The measure is symmetric, so only the upper triangle is normalised and then mirrored
+    (rows, cols) = np.triu_indices(K)
+    root = (norms[:,rows] + norms[:,cols]) / 2
+    values = dots[:,rows,cols]
+    np.divide(values, root, out=values, where=root>0)
+    # There might be no event for some object types, so this part will handle such situations
+    np.copyto(values, rows==cols, where=root==0)
+    # Python round rather than np.round, which scales by 10**precision_round first and rounds ties such as 0.525 differently
+    values = [[round(v, precision_round) for v in row] for row in values.tolist()]
+    sim = np.empty(dots.shape, dtype=np.float64)
+    sim[:,rows,cols] = values
+    sim[:,cols,rows] = values
+
+    return (sim, object_types)
+
 def discover_similarity_matrix(ocdfgmkv, precision_round=2):
-    import math
-    diff_matrix = {}
-    root_matrix = {}
-    for dir in [ocdfgmarkov_const.lbl_in, ocdfgmarkov_const.lbl_out, ocdfgmarkov_const.lbl_inout]:
-        diff_matrix[dir]={}
-        root_matrix[dir]={}
-        for ot1 in ocdfgmkv[ocdfgmarkov_const.lbl_approach].keys():
-            if not ot1 in root_matrix[dir].keys():
-                root_matrix[dir][ot1] = 0
-            for ot2 in ocdfgmkv[ocdfgmarkov_const.lbl_approach].keys():
-                if not ot2 in root_matrix[dir].keys():
-                    root_matrix[dir][ot2] = 0
-                diff = 0
-                for a1 in ocdfgmkv[ocdfg_const.lbl_activities]:
-                    for a2 in ocdfgmkv[ocdfg_const.lbl_activities]:
-                        a = get_probability(ocdfgmkv, ot1, a1, a2, dir)
-                        b = get_probability(ocdfgmkv, ot2, a1, a2, dir)
-                        if ot1==ot2:
-                            root_matrix[dir][ot1] += (a**2)
-                        diff += (a * b)
-                diff_matrix[dir][(ot1,ot2)] = diff
+    (sim, object_types) = discover_similarity_array(ocdfgmkv, precision_round)
+    K = len(object_types)
+    sim = sim.tolist()
 
     sim_matrix = {}
-    for dir in diff_matrix.keys():
-        for (i1,i2) in diff_matrix[dir].keys():
-            root = (root_matrix[dir][i1]+root_matrix[dir][i2])/2
-            # There might be no event for some object types, so this part will handle such situations
-            if root!=0:
-                sim_matrix[(i1,i2, dir)]=round((diff_matrix[dir][(i1,i2)]/root),precision_round)
-            else:
-                if i1==i2:
-                    sim_matrix[(i1,i2, dir)] = 1
-                else:
-                    sim_matrix[(i1,i2, dir)] = 0
+    for d, dir in enumerate(ocdfgmarkov_const.directions):
+        for i1 in range(K):
+            for i2 in range(K):
+                sim_matrix[(object_types[i1], object_types[i2], dir)] = sim[d][i1][i2]
 
     return sim_matrix
     
@@ -90,53 +108,59 @@ def filter_matrix(sim_matrix, threshold, dir=ocdfgmarkov_const.lbl_out):
     return {(a,b, dir):v for ((a,b,c),v) in sim_matrix.items() if c==dir and v>=threshold} 
     
     
-def discover_clusters(sim_matrix, threshold, dir=ocdfgmarkov_const.lbl_out):
-  
-  def update_clusters(cluster, index, a, b):    
-    if not index in cluster:
-      cluster[index] = set()
-
-    cluster[index].add(a)
-    cluster[index].add(b)
-    return cluster
-
-  def merge_clusters(cluster, index1, index2, a, b):    
-    c = len(cluster)
-    cluster[c] = set()
-    for a in cluster[index1]:
-      cluster[c].add(a)
-    for a in cluster[index2]:
-      cluster[c].add(a)
-    cluster.pop(index1)
-    cluster.pop(index2)    
-    cluster = update_clusters(cluster, c, a, b)
-    c = {}
-    for i in cluster:
-      c[len(c)] = cluster[i]
-    return c
-
-  def get_current_clusters_index(cluster, a, b):
-    result = set()
-    for i in cluster.keys():
-      if (a in cluster[i]) or (b in cluster[i]):
-        result.add(i)
-    return list(result)
-    
+def get_sorted_edges(sim_matrix, dir=ocdfgmarkov_const.lbl_out):
+    # (similarity, object type, object type) for one direction, most similar first
+    return sorted([(v,a,b) for ((a,b,c),v) in sim_matrix.items() if c==dir], key=lambda e: e[0], reverse=True)
 
 
-  matrix = filter_matrix(sim_matrix, threshold, dir)
+def discover_clusters(sim_matrix, threshold, dir=ocdfgmarkov_const.lbl_out):
+  return discover_clusters_from_edges(get_sorted_edges(sim_matrix, dir), threshold)
+
+
+def discover_clusters_from_edges(edges, threshold):
+
+  # Disjoint-set forest over object types, with path compression and union by rank
+
+  def find(parent, x):
+    while parent[x]!=x:
+      parent[x] = parent[parent[x]]
+      x = parent[x]
+    return x
+
+  def union(parent, rank, x, y):
+    x = find(parent, x)
+    y = find(parent, y)
+    if x==y:
+      return
+    if rank[x] < rank[y]:
+      x, y = y, x
+    parent[y] = x
+    if rank[x]==rank[y]:
+      rank[x] += 1
+
+  id_of = {}
+  parent = []
+  rank = []
+
+  for (v, o1, o2) in edges:
+    if v < threshold:
+      break
+    for o in (o1, o2):
+      if not o in id_of:
+        id_of[o] = len(parent)
+        parent.append(len(parent))
+        rank.append(0)
+    union(parent, rank, id_of[o1], id_of[o2])
+
+  # Clusters are numbered by the first appearance of any of their object types in edges, i.e. most similar edges first
+  root_index = {}
   cluster = {}
+  for o, i in id_of.items():
+    r = find(parent, i)
+    if not r in root_index:
+      root_index[r] = len(root_index)
+      cluster[root_index[r]] = set()
+    cluster[root_index[r]].add(o)
 
-  for ((o1, o2, d), v) in matrix.items():
-
-    indxs = get_current_clusters_index(cluster, o1, o2)
-
-    if indxs==[]: # none of them founded
-      cluster = update_clusters(cluster, len(cluster), o1, o2)
-    elif len(indxs)==1: # one cluster was founded
-      cluster = update_clusters(cluster, indxs[0], o1, o2)
-    else: ## two cluster is founded
-      cluster = merge_clusters(cluster, indxs[0], indxs[1], o1, o2)
-    
   return cluster
   
\ No newline at end of file
@@ -2,23 +2,32 @@ def filter_ocel(ocel, object_types=None, event_threshold=0):
   from pm4py.objects.ocel.obj import OCEL
 
   assert type(ocel) is OCEL
+
+  eid_col = ocel.event_id_column
+  oid_col = ocel.object_id_column
+  otype_col = ocel.object_type_column
+  activity_col = ocel.event_activity
   
   if object_types==None:
-    object_types = list(ocel.objects[ocel.object_type_column].unique())
+    object_types = list(ocel.objects[otype_col].unique())
 
   df_ev  = ocel.events
   df_rel = ocel.relations
   df_obj = ocel.objects
   
-  df_obj = df_obj[df_obj[ocel.object_type_column ].isin(object_types)]
-  df_rel = df_rel[df_rel[ocel.object_type_column ].isin(object_types)]
+  df_obj = df_obj[df_obj[otype_col].isin(object_types)]
+  df_rel = df_rel[df_rel[otype_col].isin(object_types)]
   
-  df_ev = df_ev[df_ev[ocel.event_id_column ].isin(df_rel[ocel.event_id_column ])]
+  df_ev = df_ev[df_ev[eid_col].isin(df_rel[eid_col])]
 
-  df_ev  = df_ev.groupby([ocel.event_activity]).filter(lambda x: len(x) >= event_threshold)
+  if event_threshold > 1:
+    df_ev  = df_ev[df_ev.groupby(activity_col, sort=False, observed=True)[activity_col].transform('size') >= event_threshold]
+  else:
+    # Every activity passes the threshold, only events without an activity are left out as the groupby would do
+    df_ev  = df_ev[df_ev[activity_col].notna()]
 
-  df_rel = df_rel[df_rel[ocel.event_id_column].isin(df_ev[ocel.event_id_column])]
+  df_rel = df_rel[df_rel[eid_col].isin(df_ev[eid_col])]
 
-  df_obj = df_obj[df_obj[ocel.object_id_column].isin(df_rel[[ocel.object_id_column]][ocel.object_id_column].unique())]
+  df_obj = df_obj[df_obj[oid_col].isin(df_rel[oid_col])]
 
   return OCEL(df_ev, df_obj, df_rel, ocel.globals, ocel.parameters)
\ No newline at end of file